@@ -3,165 +3,161 @@ GearTrade API - Refactored
 Clean architecture with separated concerns
 """
 import os
+import hmac
+import asyncio
 import secrets
 import hashlib
+import time
+from collections import defaultdict
 from pathlib import Path
 from typing import Optional
 from datetime import datetime, timedelta
 from math import radians, sin, cos, sqrt, atan2
 
-import psycopg2
-import psycopg2.extras
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, WebSocket, WebSocketDisconnect, Header
+import anyio
+import anyio.to_thread
+import asyncpg
+import boto3
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from cachetools import TTLCache
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, InvalidHashError
+from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, WebSocket, WebSocketDisconnect, Header, BackgroundTasks, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, EmailStr
 
 # ============== CONFIG ==============
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# Per worker process; keep max size x workers under Postgres max_connections
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 5))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 20))
+REDIS_URL = os.environ.get('REDIS_URL')
+# Comma-separated frontend origin(s). Required; ALLOWED_ORIGINS='*' opts into
+# allow-all for local development.
+ALLOWED_ORIGINS = [origin.strip() for origin in os.environ.get('ALLOWED_ORIGINS', '').split(',') if origin.strip()]
+if not ALLOWED_ORIGINS:
+    raise RuntimeError("ALLOWED_ORIGINS not set")
+SESSION_TTL_SECONDS = 7 * 24 * 3600
+# Per-worker token cache in front of Redis/Postgres. A logout on another worker
+# takes up to SESSION_LOCAL_CACHE_SECONDS to be seen here.
+SESSION_LOCAL_CACHE_SIZE = 10_000
+SESSION_LOCAL_CACHE_SECONDS = 60
+# Server-side secret mixed into every Argon2 password hash, so a database-only
+# leak can't be cracked offline. Hashes stored while it was unset still verify
+# and are re-hashed with the pepper on the user's next login.
+PASSWORD_PEPPER = os.environ.get('PASSWORD_PEPPER', '').encode()
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+# Set to 0 when a reverse proxy/CDN serves UPLOAD_DIR directly
+SERVE_UPLOADS_INLINE = os.environ.get('SERVE_UPLOADS_INLINE', '1') == '1'
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+ALLOWED_IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "heic"}
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Per-user GET endpoints: browsers may keep a copy but must revalidate it with
+# the ETag every time, so a user never sees stale data right after an edit
+PRIVATE_CACHE_CONTROL = "private, no-cache"
 
-app = FastAPI(title="GearTrade API", version="2.0.0")
+# Object storage for photos (S3 or any S3-compatible store such as R2).
+# When S3_BUCKET is unset, photos are written to UPLOAD_DIR and served by the API.
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+# Public base URL for stored photos; required with S3_BUCKET
+CDN_BASE_URL = os.environ.get('CDN_BASE_URL', '').rstrip('/')
+if S3_BUCKET and not CDN_BASE_URL:
+    raise RuntimeError("CDN_BASE_URL not set")
+s3_client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL) if S3_BUCKET else None
 
-# CORS
+app = FastAPI(title="GearTrade API", version="2.0.0", default_response_class=ORJSONResponse)
+
+# CORS. Auth is a bearer token header, not a cookie, so credentials are off;
+# that keeps an explicit ALLOWED_ORIGINS='*' valid for local development.
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials=False,
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,
 )
 
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+class APIGZipMiddleware(GZipMiddleware):
+    """GZip API responses; photos under /uploads are already compressed"""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/uploads/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Level 5 gets nearly all of level 9's ratio on JSON for much less CPU per response
+app.add_middleware(APIGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+class ImmutableStaticFiles(StaticFiles):
+    """Static files with far-future caching; upload filenames are random and never reused"""
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+if not S3_BUCKET and SERVE_UPLOADS_INLINE:
+    app.mount("/uploads", ImmutableStaticFiles(directory="uploads"), name="uploads")
 
 # ============== DATABASE ==============
 
-def get_db():
-    """Get database connection with RealDictCursor"""
-    if not DATABASE_URL:
-        raise RuntimeError("DATABASE_URL not set")
-    return psycopg2.connect(DATABASE_URL, cursor_factory=psycopg2.extras.RealDictCursor)
-
-def init_database():
-    """Initialize database schema"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            location TEXT,
-            latitude FLOAT,
-            longitude FLOAT,
-            bio TEXT,
-            profile_photo TEXT,
-            account_type TEXT DEFAULT 'individual',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Sessions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sessions (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            session_token TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Cars table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cars (
-            id SERIAL PRIMARY KEY,
-            owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            make TEXT NOT NULL,
-            model TEXT NOT NULL,
-            year INTEGER NOT NULL,
-            price INTEGER NOT NULL,
-            mileage INTEGER DEFAULT 0,
-            condition TEXT DEFAULT 'Good',
-            listing_type TEXT DEFAULT 'both',
-            description TEXT,
-            emoji TEXT DEFAULT '🚗',
-            view_count INTEGER DEFAULT 0,
-            boost_expires_at TIMESTAMP,
-            is_active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Car photos table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS car_photos (
-            id SERIAL PRIMARY KEY,
-            car_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
-            photo_path TEXT NOT NULL,
-            is_primary BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Likes table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS likes (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            car_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, car_id)
-        )
-    ''')
-    
-    # Dismissals table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS dismissals (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            car_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, car_id)
-        )
-    ''')
-    
-    # Matches table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS matches (
-            id SERIAL PRIMARY KEY,
-            user1_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            user2_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            car1_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
-            car2_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user1_id, user2_id)
-        )
-    ''')
-    
-    # Messages table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id SERIAL PRIMARY KEY,
-            sender_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            receiver_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            content TEXT NOT NULL,
-            is_read BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+async def get_conn():
+    """Dependency yielding a pooled connection for the duration of a request"""
+    async with app.state.pool.acquire() as conn:
+        yield conn
 
 @app.on_event("startup")
 async def startup():
-    init_database()
-    print("✅ Database initialized")
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL not set")
+    app.state.pool = await asyncpg.create_pool(
+        dsn=DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        command_timeout=60,
+        # Each pooled connection keeps up to this many server-side prepared
+        # statements keyed by SQL text, so hot queries are parsed/planned once
+        statement_cache_size=256,
+        # Session settings applied to every pooled connection. JIT compilation
+        # only pays off for long analytical queries; for these short OLTP
+        # statements it adds tens of ms whenever the planner's cost estimate
+        # crosses jit_above_cost.
+        server_settings={
+            'application_name': 'geartrade-api',
+            'jit': 'off',
+        },
+    )
+    # Schema is managed by migrate.py; just make sure the database is reachable
+    async with app.state.pool.acquire() as conn:
+        await conn.execute("SELECT 1")
+    print("✅ Database connected")
+    
+    # Session cache is optional; without Redis every lookup hits Postgres
+    app.state.redis = aioredis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+    
+    app.state.view_flusher = asyncio.create_task(flush_views_periodically())
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.view_flusher.cancel()
+    await asyncio.gather(app.state.view_flusher, return_exceptions=True)
+    # Write out whatever was buffered since the last tick before the pool goes
+    try:
+        await flush_views()
+    except Exception as e:
+        print(f"View flush error: {e}")
+    await app.state.pool.close()
+    if app.state.redis:
+        await app.state.redis.aclose()
 
 # ============== MODELS ==============
 
@@ -216,13 +212,109 @@ class MessageSend(BaseModel):
 
 # ============== AUTH HELPERS ==============
 
+# Argon2id with OWASP-recommended parameters (~64 MiB, 3 passes, 16-byte salt)
+password_hasher = PasswordHasher(
+    time_cost=3,
+    memory_cost=64 * 1024,
+    parallelism=2,
+    hash_len=32,
+    salt_len=16,
+)
+# Each hash/verify holds ~64 MiB, so cap how many run at once per worker rather
+# than sharing the default 40-thread pool
+PASSWORD_HASH_LIMITER = anyio.CapacityLimiter(os.cpu_count() or 1)
+
+def pepper_password(password: str) -> bytes:
+    """HMAC the password with the server-side pepper (no-op when unset)"""
+    if not PASSWORD_PEPPER:
+        return password.encode()
+    return hmac.new(PASSWORD_PEPPER, password.encode(), hashlib.sha256).digest()
+
 def hash_password(password: str) -> str:
-    """Hash password with SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password with Argon2id (salt and parameters embedded in the hash)"""
+    return password_hasher.hash(pepper_password(password))
+
+def verify_password(password_hash: str, password: str) -> tuple[bool, bool]:
+    """Check password against a stored Argon2id or legacy SHA256 hash; returns (valid, needs_rehash)"""
+    if not password_hash.startswith("$argon2"):
+        legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+        valid = hmac.compare_digest(password_hash, legacy_hash)
+        return valid, valid
+    try:
+        password_hasher.verify(password_hash, pepper_password(password))
+        return True, password_hasher.check_needs_rehash(password_hash)
+    except (VerifyMismatchError, InvalidHashError):
+        pass
+    # Argon2 hashes written before PASSWORD_PEPPER was set are unpeppered
+    if PASSWORD_PEPPER:
+        try:
+            password_hasher.verify(password_hash, password.encode())
+            return True, True
+        except (VerifyMismatchError, InvalidHashError):
+            pass
+    return False, False
 
 def generate_token() -> str:
     """Generate secure session token"""
-    return secrets.token_hex(32)
+    return secrets.token_urlsafe(32)
+
+# token -> (user_id, monotonic deadline at which the session itself expires)
+session_cache = TTLCache(maxsize=SESSION_LOCAL_CACHE_SIZE, ttl=SESSION_LOCAL_CACHE_SECONDS)
+
+async def cache_session(token: str, user_id: int, ttl: int = SESSION_TTL_SECONDS):
+    """Remember token -> user_id locally and in Redis for the remaining session lifetime"""
+    if ttl <= 0:
+        return
+    session_cache[token] = (user_id, time.monotonic() + ttl)
+    if app.state.redis:
+        try:
+            await app.state.redis.set(f"sess:{token}", user_id, ex=ttl)
+        except RedisError as e:
+            print(f"Session cache write failed: {e}")
+
+async def uncache_sessions(*tokens: str):
+    """Drop cached session tokens; raises RedisError if Redis can't be cleared"""
+    for token in tokens:
+        session_cache.pop(token, None)
+    if app.state.redis and tokens:
+        await app.state.redis.delete(*(f"sess:{token}" for token in tokens))
+
+SESSION_LOOKUP_SQL = """
+    SELECT user_id,
+           EXTRACT(EPOCH FROM expires_at - NOW())::int AS ttl
+    FROM sessions 
+    WHERE session_token = $1
+    AND expires_at > NOW()
+"""
+
+async def lookup_session(token: str) -> Optional[int]:
+    """Resolve a session token to a user id, trying the local cache, then Redis, then Postgres"""
+    hit = session_cache.get(token)
+    if hit and hit[1] > time.monotonic():
+        return hit[0]
+    
+    cached = None
+    if app.state.redis:
+        try:
+            cached = await app.state.redis.get(f"sess:{token}")
+        except RedisError as e:
+            # Redis is only a cache; fall through to Postgres
+            print(f"Session cache read failed: {e}")
+        if cached:
+            # Redis drops the key when the session expires, so a hit is valid for
+            # at least as long as the local entry lives
+            session_cache[token] = (int(cached), time.monotonic() + SESSION_LOCAL_CACHE_SECONDS)
+            return int(cached)
+    
+    # Only a cache miss takes a pool connection
+    async with app.state.pool.acquire() as conn:
+        session = await conn.fetchrow(SESSION_LOOKUP_SQL, token)
+    
+    if not session:
+        return None
+    
+    await cache_session(token, session['user_id'], session['ttl'])
+    return session['user_id']
 
 async def get_current_user(authorization: str = Header(None)) -> int:
     """Dependency to get current user from session token"""
@@ -230,22 +322,12 @@ async def get_current_user(authorization: str = Header(None)) -> int:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     token = authorization.split(" ")[1]
+    user_id = await lookup_session(token)
     
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT user_id FROM sessions 
-        WHERE session_token = %s
-        AND created_at + INTERVAL '7 days' > NOW()
-    """, (token,))
-    
-    result = cursor.fetchone()
-    db.close()
-    
-    if not result:
+    if not user_id:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
     
-    return result['user_id']
+    return user_id
 
 # ============== UTILITIES ==============
 
@@ -262,6 +344,48 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     
     return R * c
 
+def validate_image_upload(file: UploadFile) -> str:
+    """Reject non-image or oversized uploads before touching disk; returns the file extension"""
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    file_ext = Path(file.filename or "").suffix.lower().lstrip(".")
+    if file_ext not in ALLOWED_IMAGE_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Unsupported image type")
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+    return file_ext
+
+def save_upload(file: UploadFile, file_path: Path):
+    """Stream an upload to disk in fixed-size chunks (blocking; run in threadpool)"""
+    written = 0
+    with open(file_path, "wb") as out:
+        while chunk := file.file.read(UPLOAD_CHUNK_BYTES):
+            written += len(chunk)
+            if written > MAX_UPLOAD_BYTES:
+                break
+            out.write(chunk)
+    # Enforced here too in case the size wasn't known up front
+    if written > MAX_UPLOAD_BYTES:
+        file_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=413, detail="File too large")
+
+def upload_to_object_storage(file: UploadFile, key: str) -> str:
+    """Stream an upload to the photo bucket and return its public CDN URL (blocking; run in threadpool)"""
+    s3_client.upload_fileobj(file.file, S3_BUCKET, key, ExtraArgs={
+        "ContentType": file.content_type,
+        "CacheControl": "public, max-age=31536000, immutable",
+    })
+    return f"{CDN_BASE_URL}/{key}"
+
+def etag_response(request: Request, payload) -> Response:
+    """JSON response with an ETag; answers 304 with no body if the client already has it"""
+    body = payload if isinstance(payload, bytes) else orjson.dumps(payload)
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": PRIVATE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
 # ============== AUTH ENDPOINTS ==============
 
 @app.get("/")
@@ -269,66 +393,69 @@ async def root():
     return {"status": "ok", "app": "GearTrade API", "version": "2.0.0"}
 
 @app.post("/api/auth/signup")
-async def signup(user: UserSignup):
+async def signup(user: UserSignup, conn: asyncpg.Connection = Depends(get_conn)):
     """Create new user account"""
-    db = get_db()
-    cursor = db.cursor()
+    # Argon2 is deliberately slow CPU work; keep it off the event loop
+    password_hash = await anyio.to_thread.run_sync(hash_password, user.password, limiter=PASSWORD_HASH_LIMITER)
     
     try:
-        password_hash = hash_password(user.password)
-        cursor.execute("""
-            INSERT INTO users (username, email, password_hash, location, latitude, longitude, bio)
-            VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
-        """, (user.username, user.email, password_hash, user.location, user.latitude, user.longitude, user.bio))
-        
-        user_id = cursor.fetchone()['id']
-        
-        # Create session
-        session_token = generate_token()
-        cursor.execute("""
-            INSERT INTO sessions (user_id, session_token)
-            VALUES (%s, %s)
-        """, (user_id, session_token))
-        
-        db.commit()
-        
-        return {
-            "success": True,
-            "user_id": user_id,
-            "username": user.username,
-            "token": session_token
-        }
-    except Exception:
+        async with conn.transaction():
+            user_id = await conn.fetchval("""
+                INSERT INTO users (username, email, password_hash, location, latitude, longitude, bio)
+                VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id
+            """, user.username, user.email, password_hash, user.location, user.latitude, user.longitude, user.bio)
+            
+            # Create session
+            session_token = generate_token()
+            await conn.execute("""
+                INSERT INTO sessions (user_id, session_token)
+                VALUES ($1, $2)
+            """, user_id, session_token)
+    except asyncpg.UniqueViolationError:
         raise HTTPException(status_code=400, detail="Username or email already exists")
-    finally:
-        db.close()
+    
+    await cache_session(session_token, user_id)
+    
+    return {
+        "success": True,
+        "user_id": user_id,
+        "username": user.username,
+        "token": session_token
+    }
 
 @app.post("/api/auth/login")
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, conn: asyncpg.Connection = Depends(get_conn)):
     """Login and create session"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
+    user = await conn.fetchrow("""
         SELECT id, username, password_hash 
         FROM users 
-        WHERE username = %s
-    """, (credentials.username,))
+        WHERE username = $1
+    """, credentials.username)
     
-    user = cursor.fetchone()
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not user or user['password_hash'] != hash_password(credentials.password):
+    valid, needs_rehash = await anyio.to_thread.run_sync(
+        verify_password, user['password_hash'], credentials.password, limiter=PASSWORD_HASH_LIMITER
+    )
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Upgrade legacy, unpeppered or outdated hashes now that we have the plaintext
+    if needs_rehash:
+        await conn.execute(
+            "UPDATE users SET password_hash = $1 WHERE id = $2",
+            await anyio.to_thread.run_sync(hash_password, credentials.password, limiter=PASSWORD_HASH_LIMITER),
+            user['id']
+        )
+    
     # Create new session
     session_token = generate_token()
-    cursor.execute("""
+    await conn.execute("""
         INSERT INTO sessions (user_id, session_token)
-        VALUES (%s, %s)
-    """, (user['id'], session_token))
-    
-    db.commit()
-    db.close()
+        VALUES ($1, $2)
+    """, user['id'], session_token)
+    await cache_session(session_token, user['id'])
     
     return {
         "success": True,
@@ -338,95 +465,64 @@ async def login(credentials: UserLogin):
     }
 
 @app.post("/api/auth/logout")
-async def logout(user_id: int = Depends(get_current_user)):
+async def logout(user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Logout and invalidate session"""
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM sessions WHERE user_id = %s", (user_id,))
-    db.commit()
-    db.close()
+    # Clear the cached tokens before the delete commits: if Redis can't be
+    # cleared, the sessions stay in place rather than surviving only in Redis
+    try:
+        async with conn.transaction():
+            tokens = await conn.fetch("DELETE FROM sessions WHERE user_id = $1 RETURNING session_token", user_id)
+            await uncache_sessions(*(row['session_token'] for row in tokens))
+    except RedisError:
+        raise HTTPException(status_code=503, detail="Logout failed, please try again")
     return {"success": True}
 
 @app.get("/api/auth/me")
-async def get_me(user_id: int = Depends(get_current_user)):
+async def get_me(request: Request, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Get current user info"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
+    user = await conn.fetchrow("""
         SELECT id, username, email, location, latitude, longitude, bio, profile_photo, account_type, created_at
-        FROM users WHERE id = %s
-    """, (user_id,))
-    
-    user = cursor.fetchone()
-    db.close()
+        FROM users WHERE id = $1
+    """, user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return dict(user)
+    return etag_response(request, dict(user))
+
+# One fixed statement for every combination of fields, so asyncpg's statement
+# cache gets a hit instead of preparing a new SET list per request.
+UPDATE_ME_SQL = """
+    UPDATE users SET
+        location = COALESCE($1, location),
+        latitude = COALESCE($2, latitude),
+        longitude = COALESCE($3, longitude),
+        bio = COALESCE($4, bio)
+    WHERE id = $5
+"""
 
 @app.put("/api/auth/me")
-async def update_me(updates: UserUpdate, user_id: int = Depends(get_current_user)):
+async def update_me(updates: UserUpdate, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Update current user profile"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    fields = []
-    values = []
-    
-    if updates.location is not None:
-        fields.append("location = %s")
-        values.append(updates.location)
-    
-    if updates.latitude is not None:
-        fields.append("latitude = %s")
-        values.append(updates.latitude)
-    
-    if updates.longitude is not None:
-        fields.append("longitude = %s")
-        values.append(updates.longitude)
-    
-    if updates.bio is not None:
-        fields.append("bio = %s")
-        values.append(updates.bio)
+    fields = (updates.location, updates.latitude, updates.longitude, updates.bio)
+    if any(value is not None for value in fields):
+        await conn.execute(UPDATE_ME_SQL, *fields, user_id)
     
-    if fields:
-        values.append(user_id)
-        cursor.execute(f"""
-            UPDATE users SET {', '.join(fields)}
-            WHERE id = %s
-        """, values)
-        db.commit()
-    
-    db.close()
     return {"success": True}
 
 # ============== CAR ENDPOINTS ==============
 
-@app.get("/api/cars/marketplace")
-async def get_marketplace(
-    user_id: int = Depends(get_current_user),
-    max_distance: Optional[int] = None,
-    include_rejected: bool = False
-):
-    """Get cars for swiping (sorted by boost, then distance)"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Get current user location
-    cursor.execute("SELECT latitude, longitude FROM users WHERE id = %s", (user_id,))
-    user_location = cursor.fetchone()
-    user_lat = user_location['latitude'] if user_location else None
-    user_lng = user_location['longitude'] if user_location else None
-    
-    # Build exclusion clause
-    exclusion_clause = ""
+def build_marketplace_sql(include_rejected: bool) -> str:
+    """Build the marketplace query, optionally anti-joining dismissed cars"""
+    dismissal_join = ""
+    dismissal_clause = ""
     if not include_rejected:
-        exclusion_clause = "AND c.id NOT IN (SELECT car_id FROM dismissals WHERE user_id = %s)"
+        dismissal_join = "LEFT JOIN dismissals d ON d.car_id = c.id AND d.user_id = $1"
+        dismissal_clause = "AND d.car_id IS NULL"
     
-    # Get cars
-    query = f"""
+    # Get cars with their photos in one round-trip. The ARRAY() subquery sits in
+    # the select list so it only runs for the rows that survive ORDER BY/LIMIT.
+    return f"""
         SELECT 
             c.id, c.make, c.model, c.year, c.price, c.mileage,
             c.condition, c.listing_type, c.description, c.emoji, c.view_count,
@@ -436,25 +532,47 @@ async def get_marketplace(
             u.latitude as owner_latitude,
             u.longitude as owner_longitude,
             u.account_type as owner_account_type,
-            u.id as owner_id
+            u.id as owner_id,
+            ARRAY(
+                SELECT cp.photo_path FROM car_photos cp
+                WHERE cp.car_id = c.id
+                ORDER BY cp.is_primary DESC, cp.id ASC
+            ) AS photos
         FROM cars c
         JOIN users u ON c.owner_id = u.id
-        WHERE c.is_active = TRUE
-        AND c.owner_id != %s
-        AND c.id NOT IN (SELECT car_id FROM likes WHERE user_id = %s)
-        {exclusion_clause}
+        LEFT JOIN likes l ON l.car_id = c.id AND l.user_id = $1
+        {dismissal_join}
+        WHERE c.is_active
+        AND c.owner_id != $1
+        AND l.car_id IS NULL
+        {dismissal_clause}
         ORDER BY 
             CASE WHEN c.boost_expires_at > NOW() THEN 0 ELSE 1 END,
             c.created_at DESC
         LIMIT 100
     """
+
+# Built once at import so every request sends identical SQL text, letting
+# asyncpg reuse its per-connection prepared statement instead of re-parsing
+MARKETPLACE_SQL = {flag: build_marketplace_sql(flag) for flag in (False, True)}
+
+@app.get("/api/cars/marketplace")
+async def get_marketplace(
+    user_id: int = Depends(get_current_user),
+    conn: asyncpg.Connection = Depends(get_conn),
+    max_distance: Optional[int] = None,
+    include_rejected: bool = False
+):
+    """Get cars for swiping (sorted by boost, then distance)"""
+    # Get current user location
+    user_location = await conn.fetchrow("SELECT latitude, longitude FROM users WHERE id = $1", user_id)
+    user_lat = user_location['latitude'] if user_location else None
+    user_lng = user_location['longitude'] if user_location else None
     
-    params = (user_id, user_id, user_id) if not include_rejected else (user_id, user_id)
-    cursor.execute(query, params)
-    
-    cars = [dict(row) for row in cursor.fetchall()]
+    # Get cars
+    cars = [dict(row) for row in await conn.fetch(MARKETPLACE_SQL[include_rejected], user_id)]
     
-    # Calculate distance, filter, attach photos
+    # Calculate distance and filter
     filtered_cars = []
     for car in cars:
         # Distance calculation
@@ -467,14 +585,6 @@ async def get_marketplace(
         else:
             car['distance_miles'] = None
         
-        # Attach photos
-        cursor.execute("""
-            SELECT photo_path FROM car_photos 
-            WHERE car_id = %s 
-            ORDER BY is_primary DESC, id ASC
-        """, (car['id'],))
-        car['photos'] = [r['photo_path'] for r in cursor.fetchall()]
-        
         # Add dealer badge flag
         car['is_dealer'] = car['owner_account_type'] == 'dealer'
         
@@ -487,113 +597,133 @@ async def get_marketplace(
             x['distance_miles'] if x['distance_miles'] is not None else 999999
         ))
     
-    db.close()
-    
-    return {"cars": filtered_cars[:20]}
+    # Returning the response directly skips FastAPI's jsonable_encoder pass;
+    # orjson serializes the rows (datetimes included) on its own
+    return ORJSONResponse({"cars": filtered_cars[:20]})
 
 @app.get("/api/cars/my-garage")
-async def get_my_garage(user_id: int = Depends(get_current_user)):
+async def get_my_garage(request: Request, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Get current user's cars"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
+    rows = await conn.fetch("""
         SELECT 
-            id, make, model, year, price, mileage, condition, 
-            listing_type, description, emoji, view_count, boost_expires_at, created_at
-        FROM cars
-        WHERE owner_id = %s AND is_active = TRUE
-        ORDER BY created_at DESC
-    """, (user_id,))
-    
-    cars = [dict(row) for row in cursor.fetchall()]
+            c.id, c.make, c.model, c.year, c.price, c.mileage, c.condition, 
+            c.listing_type, c.description, c.emoji, c.view_count, c.boost_expires_at, c.created_at,
+            ARRAY(
+                SELECT cp.photo_path FROM car_photos cp
+                WHERE cp.car_id = c.id
+                ORDER BY cp.is_primary DESC, cp.id ASC
+            ) AS photos
+        FROM cars c
+        WHERE c.owner_id = $1 AND c.is_active
+        ORDER BY c.created_at DESC
+    """, user_id)
     
-    # Attach photos
-    for car in cars:
-        cursor.execute("""
-            SELECT photo_path FROM car_photos 
-            WHERE car_id = %s 
-            ORDER BY is_primary DESC, id ASC
-        """, (car['id'],))
-        car['photos'] = [r['photo_path'] for r in cursor.fetchall()]
+    cars = [dict(row) for row in rows]
     
-    db.close()
-    return {"cars": cars}
+    return etag_response(request, {"cars": cars})
 
 @app.post("/api/cars")
-async def create_car(car: CarCreate, user_id: int = Depends(get_current_user)):
+async def create_car(car: CarCreate, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Create new car listing"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
+    car_id = await conn.fetchval("""
         INSERT INTO cars (owner_id, make, model, year, price, mileage, condition, listing_type, description, emoji)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
         RETURNING id
-    """, (user_id, car.make, car.model, car.year, car.price, car.mileage, car.condition, car.listing_type, car.description, car.emoji))
-    
-    car_id = cursor.fetchone()['id']
-    db.commit()
-    db.close()
+    """, user_id, car.make, car.model, car.year, car.price, car.mileage, car.condition, car.listing_type, car.description, car.emoji)
     
     return {"success": True, "car_id": car_id}
 
+# Single cacheable statement; the owner check rides along in the WHERE clause
+UPDATE_CAR_SQL = """
+    UPDATE cars SET
+        make = COALESCE($1, make),
+        model = COALESCE($2, model),
+        year = COALESCE($3, year),
+        price = COALESCE($4, price),
+        mileage = COALESCE($5, mileage),
+        condition = COALESCE($6, condition),
+        listing_type = COALESCE($7, listing_type),
+        description = COALESCE($8, description),
+        emoji = COALESCE($9, emoji)
+    WHERE id = $10 AND owner_id = $11
+    RETURNING id
+"""
+
 @app.put("/api/cars/{car_id}")
-async def update_car(car_id: int, updates: CarUpdate, user_id: int = Depends(get_current_user)):
+async def update_car(car_id: int, updates: CarUpdate, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Update car listing"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Verify ownership
-    cursor.execute("SELECT owner_id FROM cars WHERE id = %s", (car_id,))
-    car = cursor.fetchone()
-    
-    if not car or car['owner_id'] != user_id:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    
-    # Build update query
-    fields = []
-    values = []
-    
-    for field, value in updates.dict(exclude_unset=True).items():
-        fields.append(f"{field} = %s")
-        values.append(value)
-    
-    if fields:
-        values.append(car_id)
-        cursor.execute(f"""
-            UPDATE cars SET {', '.join(fields)}
-            WHERE id = %s
-        """, values)
-        db.commit()
+    updated = await conn.fetchval(
+        UPDATE_CAR_SQL,
+        updates.make, updates.model, updates.year, updates.price, updates.mileage,
+        updates.condition, updates.listing_type, updates.description, updates.emoji,
+        car_id, user_id
+    )
+    
+    if updated is None:
+        raise HTTPException(status_code=403, detail="Not authorized or car not found")
     
-    db.close()
     return {"success": True}
 
 @app.delete("/api/cars/{car_id}")
-async def delete_car(car_id: int, user_id: int = Depends(get_current_user)):
+async def delete_car(car_id: int, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Soft delete car listing"""
-    db = get_db()
-    cursor = db.cursor()
+    deleted = await conn.fetchval(
+        "UPDATE cars SET is_active = FALSE WHERE id = $1 AND owner_id = $2 RETURNING id", car_id, user_id
+    )
     
-    cursor.execute("UPDATE cars SET is_active = FALSE WHERE id = %s AND owner_id = %s", (car_id, user_id))
-    
-    if cursor.rowcount == 0:
+    if deleted is None:
         raise HTTPException(status_code=403, detail="Not authorized or car not found")
     
-    db.commit()
-    db.close()
-    
     return {"success": True}
 
+# Views are buffered in memory and written in one UPDATE per flush instead of
+# one row-locking UPDATE per page view
+VIEW_FLUSH_INTERVAL_SECONDS = 5
+PG_INT_MAX = 2**31 - 1
+pending_views: defaultdict[int, int] = defaultdict(int)
+
+async def flush_views():
+    """Write buffered view counts to the database"""
+    if not pending_views:
+        return
+    
+    batch = dict(pending_views)
+    pending_views.clear()
+    
+    try:
+        async with app.state.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE cars SET view_count = view_count + data.n
+                FROM unnest($1::bigint[], $2::int[]) AS data(id, n)
+                WHERE cars.id = data.id
+            """, list(batch.keys()), list(batch.values()))
+    except (OSError, asyncio.TimeoutError, asyncio.CancelledError,
+            asyncpg.PostgresConnectionError, asyncpg.InterfaceError):
+        # Transient: put the counts back so the next flush retries them
+        # (including when the periodic task is cancelled mid-flush at shutdown)
+        for car_id, n in batch.items():
+            pending_views[car_id] += n
+        raise
+    except Exception as e:
+        # Anything else would fail the same way on every retry; drop the batch
+        # rather than wedge the buffer
+        print(f"Dropping {len(batch)} buffered view counts: {e}")
+
+async def flush_views_periodically():
+    """Background task flushing buffered views every few seconds"""
+    while True:
+        await asyncio.sleep(VIEW_FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush_views()
+        except Exception as e:
+            print(f"View flush error: {e}")
+
 @app.post("/api/cars/{car_id}/view")
 async def increment_view(car_id: int, user_id: int = Depends(get_current_user)):
     """Increment view count"""
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("UPDATE cars SET view_count = view_count + 1 WHERE id = %s", (car_id,))
-    db.commit()
-    db.close()
+    if not 0 < car_id <= PG_INT_MAX:
+        raise HTTPException(status_code=404, detail="Car not found")
+    pending_views[car_id] += 1
     return {"success": True}
 
 @app.post("/api/upload/car-photo/{car_id}")
@@ -601,130 +731,108 @@ async def upload_car_photo(
     car_id: int,
     file: UploadFile = File(...),
     is_primary: bool = False,
-    user_id: int = Depends(get_current_user)
+    user_id: int = Depends(get_current_user),
+    conn: asyncpg.Connection = Depends(get_conn)
 ):
     """Upload car photo"""
-    db = get_db()
-    cursor = db.cursor()
-    
     # Verify ownership
-    cursor.execute("SELECT owner_id FROM cars WHERE id = %s", (car_id,))
-    car = cursor.fetchone()
+    owner_id = await conn.fetchval("SELECT owner_id FROM cars WHERE id = $1", car_id)
     
-    if not car or car['owner_id'] != user_id:
+    if owner_id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    file_ext = validate_image_upload(file)
+    
     # Save file
-    file_ext = file.filename.split('.')[-1]
     filename = f"car_{car_id}_{secrets.token_hex(8)}.{file_ext}"
-    file_path = UPLOAD_DIR / filename
-    
-    with open(file_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
     
-    # Unset other primary photos if this is primary
-    if is_primary:
-        cursor.execute("UPDATE car_photos SET is_primary = FALSE WHERE car_id = %s", (car_id,))
+    if S3_BUCKET:
+        photo_path = await run_in_threadpool(upload_to_object_storage, file, f"cars/{filename}")
+    else:
+        await run_in_threadpool(save_upload, file, UPLOAD_DIR / filename)
+        photo_path = f"/uploads/{filename}"
     
-    # Add to database
-    cursor.execute("""
-        INSERT INTO car_photos (car_id, photo_path, is_primary)
-        VALUES (%s, %s, %s)
-    """, (car_id, f"/uploads/{filename}", is_primary))
-    
-    db.commit()
-    db.close()
+    async with conn.transaction():
+        # Unset other primary photos if this is primary
+        if is_primary:
+            await conn.execute("UPDATE car_photos SET is_primary = FALSE WHERE car_id = $1", car_id)
+        
+        # Add to database
+        await conn.execute("""
+            INSERT INTO car_photos (car_id, photo_path, is_primary)
+            VALUES ($1, $2, $3)
+        """, car_id, photo_path, is_primary)
     
-    return {"success": True, "photo_path": f"/uploads/{filename}"}
+    return {"success": True, "photo_path": photo_path}
 
 # ============== SWIPE ENDPOINTS ==============
 
+# Like + reciprocity check + match insert in one atomic round-trip.
+# car1_id/car2_id follow user1_id/user2_id, which get_matches relies on.
+SWIPE_LIKE_SQL = """
+    WITH liked AS (
+        INSERT INTO likes (user_id, car_id)
+        VALUES ($1, $2)
+        ON CONFLICT DO NOTHING
+    ),
+    reciprocal AS (
+        -- Walks their likes via the UNIQUE (user_id, car_id) index and stops
+        -- at the first one on a car we own
+        SELECT them.owner_id AS their_user_id, them.id AS their_car_id, l.car_id AS my_car_id
+        FROM cars them
+        JOIN likes l ON l.user_id = them.owner_id
+        WHERE them.id = $2
+        AND EXISTS (SELECT 1 FROM cars mine WHERE mine.id = l.car_id AND mine.owner_id = $1)
+        LIMIT 1
+    ),
+    matched AS (
+        INSERT INTO matches (user1_id, user2_id, car1_id, car2_id)
+        SELECT
+            LEAST($1, their_user_id),
+            GREATEST($1, their_user_id),
+            CASE WHEN $1 < their_user_id THEN my_car_id ELSE their_car_id END,
+            CASE WHEN $1 < their_user_id THEN their_car_id ELSE my_car_id END
+        FROM reciprocal
+        ON CONFLICT DO NOTHING
+    )
+    SELECT r.their_user_id, u.username
+    FROM reciprocal r
+    JOIN users u ON u.id = r.their_user_id
+"""
+
 @app.post("/api/swipe")
-async def swipe(swipe: SwipeAction, user_id: int = Depends(get_current_user)):
+async def swipe(swipe: SwipeAction, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Handle swipe (like or nope)"""
-    db = get_db()
-    cursor = db.cursor()
-    
     if swipe.action == 'like':
-        # Add like
-        cursor.execute("""
-            INSERT INTO likes (user_id, car_id)
-            VALUES (%s, %s)
-            ON CONFLICT DO NOTHING
-        """, (user_id, swipe.car_id))
-        
-        # Check for match
-        cursor.execute("""
-            SELECT c.owner_id, c.id as their_car_id
-            FROM cars c
-            WHERE c.id = %s
-        """, (swipe.car_id,))
+        # Add like and check for match
+        match = await conn.fetchrow(SWIPE_LIKE_SQL, user_id, swipe.car_id)
         
-        their_car = cursor.fetchone()
-        
-        if their_car:
-            # Check if they liked any of our cars
-            cursor.execute("""
-                SELECT l.car_id as my_car_id
-                FROM likes l
-                JOIN cars c ON l.car_id = c.id
-                WHERE l.user_id = %s AND c.owner_id = %s
-                LIMIT 1
-            """, (their_car['owner_id'], user_id))
-            
-            my_liked_car = cursor.fetchone()
-            
-            if my_liked_car:
-                # It's a match!
-                try:
-                    cursor.execute("""
-                        INSERT INTO matches (user1_id, user2_id, car1_id, car2_id)
-                        VALUES (%s, %s, %s, %s)
-                    """, (min(user_id, their_car['owner_id']),
-                          max(user_id, their_car['owner_id']),
-                          my_liked_car['my_car_id'],
-                          their_car['their_car_id']))
-                except Exception:
-                    pass  # Match already exists
-                
-                db.commit()
-                
-                # Get match details
-                cursor.execute("SELECT username FROM users WHERE id = %s", (their_car['owner_id'],))
-                other_user = cursor.fetchone()
-                
-                db.close()
-                
-                return {
-                    "success": True,
-                    "match": True,
-                    "matched_user": other_user['username'],
-                    "matched_user_id": their_car['owner_id']
-                }
+        if match:
+            # It's a match!
+            return {
+                "success": True,
+                "match": True,
+                "matched_user": match['username'],
+                "matched_user_id": match['their_user_id']
+            }
     
     elif swipe.action == 'nope':
         # Add dismissal
-        cursor.execute("""
+        await conn.execute("""
             INSERT INTO dismissals (user_id, car_id)
-            VALUES (%s, %s)
+            VALUES ($1, $2)
             ON CONFLICT DO NOTHING
-        """, (user_id, swipe.car_id))
-    
-    db.commit()
-    db.close()
+        """, user_id, swipe.car_id)
     
     return {"success": True, "match": False}
 
 # ============== MATCH ENDPOINTS ==============
 
 @app.get("/api/matches")
-async def get_matches(user_id: int = Depends(get_current_user)):
+async def get_matches(request: Request, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Get all matches for current user"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
+    # Unread counts are kept on the match row itself
+    rows = await conn.fetch("""
         SELECT
             base.matched_user_id,
             base.their_car_id,
@@ -734,99 +842,126 @@ async def get_matches(user_id: int = Depends(get_current_user)):
             u.account_type,
             c.make || ' ' || c.model AS their_car,
             c.emoji AS their_emoji,
-            (SELECT COUNT(*) FROM messages
-             WHERE sender_id = base.matched_user_id
-               AND receiver_id = %s
-               AND is_read = FALSE) AS unread_count,
+            base.unread_count,
             base.matched_at
         FROM (
             SELECT
-                CASE WHEN m.user1_id = %s THEN m.user2_id ELSE m.user1_id END AS matched_user_id,
-                CASE WHEN m.user1_id = %s THEN m.car2_id ELSE m.car1_id END AS their_car_id,
-                CASE WHEN m.user1_id = %s THEN m.car1_id ELSE m.car2_id END AS my_car_id,
+                CASE WHEN m.user1_id = $1 THEN m.user2_id ELSE m.user1_id END AS matched_user_id,
+                CASE WHEN m.user1_id = $1 THEN m.car2_id ELSE m.car1_id END AS their_car_id,
+                CASE WHEN m.user1_id = $1 THEN m.car1_id ELSE m.car2_id END AS my_car_id,
+                CASE WHEN m.user1_id = $1 THEN m.user1_unread ELSE m.user2_unread END AS unread_count,
                 m.created_at AS matched_at
             FROM matches m
-            WHERE %s IN (m.user1_id, m.user2_id)
+            WHERE $1 IN (m.user1_id, m.user2_id)
         ) AS base
         JOIN users u ON u.id = base.matched_user_id
         JOIN cars c ON c.id = base.their_car_id
         ORDER BY base.matched_at DESC
-    """, (user_id, user_id, user_id, user_id, user_id))
+    """, user_id)
     
-    matches = [dict(row) for row in cursor.fetchall()]
+    matches = [dict(row) for row in rows]
     
     # Add dealer badge flag
     for match in matches:
         match['is_dealer'] = match['account_type'] == 'dealer'
     
-    db.close()
-    
-    return {"matches": matches}
+    return etag_response(request, {"matches": matches})
 
 # ============== MESSAGE ENDPOINTS ==============
 
+UNREAD_COUNT_SQL = """
+    SELECT COUNT(*)
+    FROM messages
+    WHERE receiver_id = $1 AND NOT is_read
+"""
+
 @app.get("/api/messages/unread/count")
-async def get_unread_count(user_id: int = Depends(get_current_user)):
+async def get_unread_count(user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Get total unread message count"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    cursor.execute("""
-        SELECT COUNT(*) as count
-        FROM messages
-        WHERE receiver_id = %s AND is_read = FALSE
-    """, (user_id,))
+    count = await conn.fetchval(UNREAD_COUNT_SQL, user_id)
     
-    result = cursor.fetchone()
-    db.close()
-    
-    return {"unread_count": result['count']}
+    return {"unread_count": count}
+
+MESSAGES_PAGE_MAX = 200
+
+# Match check, receiver's unread bump and insert in one statement ($1 sender,
+# $2 receiver). Matches store the pair as (LEAST, GREATEST), so the check is a
+# single seek on the UNIQUE (user1_id, user2_id) index. No row means not matched.
+SEND_MESSAGE_SQL = """
+    WITH counted AS (
+        UPDATE matches SET
+            user1_unread = user1_unread + CASE WHEN user1_id = $2 THEN 1 ELSE 0 END,
+            user2_unread = user2_unread + CASE WHEN user2_id = $2 THEN 1 ELSE 0 END
+        WHERE user1_id = LEAST($1::int, $2::int) AND user2_id = GREATEST($1::int, $2::int)
+        RETURNING id
+    )
+    INSERT INTO messages (sender_id, receiver_id, content)
+    SELECT $1, $2, $3 FROM counted
+    RETURNING id, created_at
+"""
+
+# Marks the messages read and zeroes the reader's counter in one statement
+MARK_READ_SQL = """
+    WITH marked AS (
+        UPDATE messages SET is_read = TRUE
+        WHERE sender_id = $1 AND receiver_id = $2 AND NOT is_read
+        RETURNING 1
+    )
+    -- Subtract only what was flipped here: a message sent concurrently may have
+    -- bumped the counter without being visible to this statement
+    UPDATE matches SET
+        user1_unread = CASE WHEN user1_id = $2 THEN GREATEST(user1_unread - (SELECT COUNT(*) FROM marked), 0) ELSE user1_unread END,
+        user2_unread = CASE WHEN user2_id = $2 THEN GREATEST(user2_unread - (SELECT COUNT(*) FROM marked), 0) ELSE user2_unread END
+    WHERE user1_id = LEAST($1::int, $2::int) AND user2_id = GREATEST($1::int, $2::int)
+"""
+
+async def mark_messages_read(sender_id: int, receiver_id: int):
+    """Mark everything sender_id has sent to receiver_id as read"""
+    async with app.state.pool.acquire() as conn:
+        await conn.execute(MARK_READ_SQL, sender_id, receiver_id)
 
 @app.get("/api/messages/{other_user_id}")
-async def get_messages(other_user_id: int, user_id: int = Depends(get_current_user)):
-    """Get message history with another user"""
-    db = get_db()
-    cursor = db.cursor()
+async def get_messages(
+    other_user_id: int,
+    background_tasks: BackgroundTasks,
+    before_id: Optional[int] = None,
+    limit: int = 50,
+    user_id: int = Depends(get_current_user),
+    conn: asyncpg.Connection = Depends(get_conn)
+):
+    """Get a page of message history with another user (newest page unless before_id is given)"""
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
     
-    cursor.execute("""
+    # Keyset pagination over idx_messages_conv
+    rows = await conn.fetch("""
         SELECT 
             id, sender_id, receiver_id, content, is_read, created_at
         FROM messages
-        WHERE (sender_id = %s AND receiver_id = %s)
-           OR (sender_id = %s AND receiver_id = %s)
-        ORDER BY created_at ASC
-    """, (user_id, other_user_id, other_user_id, user_id))
+        WHERE LEAST(sender_id, receiver_id) = LEAST($1::int, $2::int)
+          AND GREATEST(sender_id, receiver_id) = GREATEST($1::int, $2::int)
+          AND ($3::int IS NULL OR id < $3)
+        ORDER BY id DESC
+        LIMIT $4
+    """, user_id, other_user_id, before_id, limit)
+    
+    # Return in chronological order
+    messages = [dict(row) for row in reversed(rows)]
     
-    messages = [dict(row) for row in cursor.fetchall()]
-    db.close()
+    # Opening the conversation reads it; don't hold the response for the write
+    if before_id is None:
+        background_tasks.add_task(mark_messages_read, other_user_id, user_id)
     
     return {"messages": messages}
 
 @app.post("/api/messages")
-async def send_message(message: MessageSend, user_id: int = Depends(get_current_user)):
+async def send_message(message: MessageSend, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Send a message"""
-    db = get_db()
-    cursor = db.cursor()
+    msg = await conn.fetchrow(SEND_MESSAGE_SQL, user_id, message.receiver_id, message.content)
     
-    # Verify they're matched
-    cursor.execute("""
-        SELECT id FROM matches
-        WHERE (%s IN (user1_id, user2_id)) AND (%s IN (user1_id, user2_id))
-    """, (user_id, message.receiver_id))
-    
-    if not cursor.fetchone():
+    if not msg:
         raise HTTPException(status_code=403, detail="Not matched with this user")
     
-    cursor.execute("""
-        INSERT INTO messages (sender_id, receiver_id, content)
-        VALUES (%s, %s, %s) RETURNING id
-    """, (user_id, message.receiver_id, message.content))
-    
-    message_id = cursor.fetchone()['id']
-    db.commit()
-    db.close()
-    
-    return {"success": True, "message_id": message_id}
+    return {"success": True, "message_id": msg['id']}
 
 # ============== WEBSOCKET CHAT ==============
 
@@ -855,21 +990,12 @@ manager = ConnectionManager()
 async def websocket_chat(websocket: WebSocket, token: str):
     """WebSocket endpoint for real-time chat"""
     # Verify token
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT user_id FROM sessions 
-        WHERE session_token = %s
-        AND created_at + INTERVAL '7 days' > NOW()
-    """, (token,))
-    result = cursor.fetchone()
-    db.close()
-    
-    if not result:
+    user_id = await lookup_session(token)
+    
+    if not user_id:
         await websocket.close(code=1008)
         return
     
-    user_id = result['user_id']
     await manager.connect(user_id, websocket)
     
     try:
@@ -878,15 +1004,12 @@ async def websocket_chat(websocket: WebSocket, token: str):
             
             if data.get('type') == 'message':
                 # Save message
-                db = get_db()
-                cursor = db.cursor()
-                cursor.execute("""
-                    INSERT INTO messages (sender_id, receiver_id, content)
-                    VALUES (%s, %s, %s) RETURNING id, created_at
-                """, (user_id, data['receiver_id'], data['content']))
-                msg = cursor.fetchone()
-                db.commit()
-                db.close()
+                async with app.state.pool.acquire() as conn:
+                    msg = await conn.fetchrow(SEND_MESSAGE_SQL, user_id, data['receiver_id'], data['content'])
+                
+                if not msg:
+                    await websocket.send_json({'type': 'error', 'detail': 'Not matched with this user'})
+                    continue
                 
                 # Send to receiver
                 await manager.send_message(data['receiver_id'], {
@@ -914,14 +1037,7 @@ async def websocket_chat(websocket: WebSocket, token: str):
             
             elif data.get('type') == 'mark_read':
                 # Mark messages as read
-                db = get_db()
-                cursor = db.cursor()
-                cursor.execute("""
-                    UPDATE messages SET is_read = TRUE
-                    WHERE sender_id = %s AND receiver_id = %s AND is_read = FALSE
-                """, (data['sender_id'], user_id))
-                db.commit()
-                db.close()
+                await mark_messages_read(data['sender_id'], user_id)
     
     except WebSocketDisconnect:
         manager.disconnect(user_id)
@@ -931,103 +1047,81 @@ async def websocket_chat(websocket: WebSocket, token: str):
 
 # ============== STATS ENDPOINTS ==============
 
+STATS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM matches WHERE $1 IN (user1_id, user2_id)) AS matches,
+        (SELECT COUNT(*) FROM likes WHERE user_id = $1) AS likes_given,
+        (SELECT COUNT(*) FROM likes l JOIN cars c ON l.car_id = c.id WHERE c.owner_id = $1) AS likes_received,
+        (SELECT COUNT(*) FROM cars WHERE owner_id = $1 AND is_active) AS cars,
+        (SELECT COALESCE(SUM(view_count), 0) FROM cars WHERE owner_id = $1) AS total_views
+"""
+STATS_CACHE_TTL_SECONDS = 30
+
 @app.get("/api/stats")
-async def get_stats(user_id: int = Depends(get_current_user)):
+async def get_stats(request: Request, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Get user statistics"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Total matches
-    cursor.execute("""
-        SELECT COUNT(*) as count FROM matches
-        WHERE %s IN (user1_id, user2_id)
-    """, (user_id,))
-    matches_count = cursor.fetchone()['count']
-    
-    # Total likes given
-    cursor.execute("SELECT COUNT(*) as count FROM likes WHERE user_id = %s", (user_id,))
-    likes_given = cursor.fetchone()['count']
-    
-    # Total likes received
-    cursor.execute("""
-        SELECT COUNT(*) as count FROM likes l
-        JOIN cars c ON l.car_id = c.id
-        WHERE c.owner_id = %s
-    """, (user_id,))
-    likes_received = cursor.fetchone()['count']
-    
-    # Total cars
-    cursor.execute("SELECT COUNT(*) as count FROM cars WHERE owner_id = %s AND is_active = TRUE", (user_id,))
-    cars_count = cursor.fetchone()['count']
-    
-    # Total views
-    cursor.execute("SELECT SUM(view_count) as total FROM cars WHERE owner_id = %s", (user_id,))
-    total_views = cursor.fetchone()['total'] or 0
-    
-    db.close()
-    
-    return {
-        "matches": matches_count,
-        "likes_given": likes_given,
-        "likes_received": likes_received,
-        "cars": cars_count,
-        "total_views": total_views
-    }
+    # Dashboards poll this; serve a short-lived cached copy when Redis is available
+    cache_key = f"stats:{user_id}"
+    if app.state.redis:
+        try:
+            cached = await app.state.redis.get(cache_key)
+        except RedisError as e:
+            print(f"Stats cache read failed: {e}")
+            cached = None
+        if cached:
+            # Already serialized; hash and send the cached bytes as-is
+            return etag_response(request, cached.encode())
+    
+    stats = orjson.dumps(dict(await conn.fetchrow(STATS_SQL, user_id)))
+    
+    if app.state.redis:
+        try:
+            await app.state.redis.set(cache_key, stats, ex=STATS_CACHE_TTL_SECONDS)
+        except RedisError as e:
+            print(f"Stats cache write failed: {e}")
+    
+    return etag_response(request, stats)
 
 # ============== PROFILE ENDPOINTS ==============
 
 @app.get("/api/users/{username}")
-async def get_user_profile(username: str, user_id: int = Depends(get_current_user)):
+async def get_user_profile(username: str, user_id: int = Depends(get_current_user), conn: asyncpg.Connection = Depends(get_conn)):
     """Get public profile for a user"""
-    db = get_db()
-    cursor = db.cursor()
-    
     # Get user
-    cursor.execute("""
+    user = await conn.fetchrow("""
         SELECT id, username, location, bio, account_type, created_at
         FROM users
-        WHERE username = %s
-    """, (username,))
-    
-    user = cursor.fetchone()
+        WHERE username = $1
+    """, username)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     profile_user_id = user['id']
     
-    # Get their cars
-    cursor.execute("""
+    # Get their cars with photos
+    rows = await conn.fetch("""
         SELECT 
             c.id, c.make, c.model, c.year, c.price, c.mileage,
-            c.condition, c.listing_type, c.emoji, c.view_count
+            c.condition, c.listing_type, c.emoji, c.view_count,
+            ARRAY(
+                SELECT cp.photo_path FROM car_photos cp
+                WHERE cp.car_id = c.id
+                ORDER BY cp.is_primary DESC, cp.id ASC
+            ) AS photos
         FROM cars c
-        WHERE c.owner_id = %s AND c.is_active = TRUE
+        WHERE c.owner_id = $1 AND c.is_active
         ORDER BY c.created_at DESC
-    """, (profile_user_id,))
+    """, profile_user_id)
     
-    cars = [dict(row) for row in cursor.fetchall()]
-    
-    # Attach photos
-    for car in cars:
-        cursor.execute("""
-            SELECT photo_path FROM car_photos 
-            WHERE car_id = %s 
-            ORDER BY is_primary DESC, id ASC
-        """, (car['id'],))
-        car['photos'] = [r['photo_path'] for r in cursor.fetchall()]
+    cars = [dict(row) for row in rows]
     
     # Get stats
-    cursor.execute("SELECT COUNT(*) as count FROM matches WHERE %s IN (user1_id, user2_id)", (profile_user_id,))
-    matches_count = cursor.fetchone()['count']
-    
-    cursor.execute("SELECT COUNT(*) as count FROM cars WHERE owner_id = %s AND is_active = TRUE", (profile_user_id,))
-    cars_count = cursor.fetchone()['count']
+    matches_count = await conn.fetchval("SELECT COUNT(*) FROM matches WHERE $1 IN (user1_id, user2_id)", profile_user_id)
     
-    cursor.execute("SELECT SUM(view_count) as total FROM cars WHERE owner_id = %s", (profile_user_id,))
-    total_views = cursor.fetchone()['total'] or 0
+    cars_count = await conn.fetchval("SELECT COUNT(*) FROM cars WHERE owner_id = $1 AND is_active", profile_user_id)
     
-    db.close()
+    total_views = await conn.fetchval("SELECT SUM(view_count) FROM cars WHERE owner_id = $1", profile_user_id) or 0
     
     user_dict = dict(user)
     user_dict['is_dealer'] = user_dict['account_type'] == 'dealer'
@@ -1047,4 +1141,12 @@ async def get_user_profile(username: str, user_id: int = Depends(get_current_use
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "api_backend:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        # One async worker per core; each one is a single GIL-bound process
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+    )
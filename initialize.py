@@ -1,6 +1,6 @@
 """
 GearTrade Initialize — PostgreSQL version
-Run once to seed the database with users and cars.
+Run once (after `python migrate.py`) to seed the database with users and cars.
 """
 import os, hashlib
 import psycopg2
@@ -12,6 +12,9 @@ if not DATABASE_URL:
 
 def h(p): return hashlib.sha256(p.encode()).hexdigest()
 
+# Every seeded account shares this password
+PW_HASH = h("password123")
+
 USERS = [
     ("alexracing",    "alex@gt.com",    "Miami, FL",       "Porsche obsessive. PDK only."),
     ("jordan_drives", "jordan@gt.com",  "Los Angeles, CA", "Italian cars or nothing."),
@@ -74,19 +77,12 @@ def seed():
         conn.close()
         return
 
-    user_ids = {}
-    for username, email, location, bio in USERS:
-        try:
-            c.execute("INSERT INTO users (username,email,password_hash,location,bio) VALUES (%s,%s,%s,%s,%s) RETURNING id",
-                      (username, email, h("password123"), location, bio))
-            user_ids[username] = c.fetchone()['id']
-            print(f"  ✅ User: {username}")
-        except Exception:
-            conn.rollback()
-            c.execute("SELECT id FROM users WHERE username=%s", (username,))
-            row = c.fetchone()
-            if row: user_ids[username] = row['id']
-
+    # Existing users are left alone; every seeded username maps to an id afterwards
+    psycopg2.extras.execute_values(c, "INSERT INTO users (username,email,password_hash,location,bio) VALUES %s ON CONFLICT DO NOTHING",
+                                   [(username, email, PW_HASH, location, bio) for username, email, location, bio in USERS])
+    print(f"  ✅ Users: {c.rowcount} new, {len(USERS) - c.rowcount} existing")
+    c.execute("SELECT username, id FROM users")
+    user_ids = {row['username']: row['id'] for row in c.fetchall()}
     conn.commit()
 
     for car in CARS:
@@ -98,10 +94,9 @@ def seed():
                       (oid, car["make"], car["model"], car["year"], car["price"],
                        car["mileage"], car["condition"], car["type"], car["desc"], car["emoji"]))
             cid = c.fetchone()['id']
-            for i, url in enumerate(car["photos"]):
-                c.execute("INSERT INTO car_photos (car_id,photo_path,is_primary) VALUES (%s,%s,%s)",
-                          (cid, url, i == 0))
-            print(f"  ✅ {car['year']} {car['make']} {car['model']} — {len(car['photos'])} photos")
+            # All of a car's photos in one multi-row VALUES insert
+            psycopg2.extras.execute_values(c, "INSERT INTO car_photos (car_id,photo_path,is_primary) VALUES %s",
+                                           [(cid, url, i == 0) for i, url in enumerate(car["photos"])])
         except Exception as e:
             conn.rollback()
             print(f"  ❌ {car['model']}: {e}")
@@ -0,0 +1,179 @@
+"""
+GearTrade Migrate
+Creates/updates the database schema. Run once per deploy, before the API starts:
+    python migrate.py
+Concurrent runs (e.g. several replicas booting at once) serialize on an
+advisory lock, and every statement is idempotent. Once a database is at
+SCHEMA_VERSION the DDL is skipped entirely.
+"""
+import os
+import asyncio
+
+import asyncpg
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+# Bump whenever SCHEMA_SQL changes so existing databases pick up the new DDL
+SCHEMA_VERSION = 2
+
+# The whole schema as one script, sent in a single round-trip. Every statement
+# is idempotent.
+SCHEMA_SQL = """
+    -- Users table
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        location TEXT,
+        latitude FLOAT,
+        longitude FLOAT,
+        bio TEXT,
+        profile_photo TEXT,
+        account_type TEXT DEFAULT 'individual',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Sessions table
+    CREATE TABLE IF NOT EXISTS sessions (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        session_token TEXT UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP + INTERVAL '7 days'
+    );
+
+    -- Sessions created before expires_at existed get the same 7-day lifetime
+    ALTER TABLE sessions ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP;
+    UPDATE sessions SET expires_at = COALESCE(created_at, CURRENT_TIMESTAMP) + INTERVAL '7 days' WHERE expires_at IS NULL;
+    ALTER TABLE sessions
+        ALTER COLUMN expires_at SET DEFAULT CURRENT_TIMESTAMP + INTERVAL '7 days',
+        ALTER COLUMN expires_at SET NOT NULL;
+
+    -- Cars table
+    CREATE TABLE IF NOT EXISTS cars (
+        id SERIAL PRIMARY KEY,
+        owner_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        make TEXT NOT NULL,
+        model TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        price INTEGER NOT NULL,
+        mileage INTEGER DEFAULT 0,
+        condition TEXT DEFAULT 'Good',
+        listing_type TEXT DEFAULT 'both',
+        description TEXT,
+        emoji TEXT DEFAULT '🚗',
+        view_count INTEGER DEFAULT 0,
+        boost_expires_at TIMESTAMP,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Car photos table
+    CREATE TABLE IF NOT EXISTS car_photos (
+        id SERIAL PRIMARY KEY,
+        car_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
+        photo_path TEXT NOT NULL,
+        is_primary BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Likes table
+    CREATE TABLE IF NOT EXISTS likes (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        car_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, car_id)
+    );
+
+    -- Dismissals table
+    CREATE TABLE IF NOT EXISTS dismissals (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        car_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, car_id)
+    );
+
+    -- Matches table
+    CREATE TABLE IF NOT EXISTS matches (
+        id SERIAL PRIMARY KEY,
+        user1_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        user2_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        car1_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
+        car2_id INTEGER REFERENCES cars(id) ON DELETE CASCADE,
+        user1_unread INTEGER NOT NULL DEFAULT 0,
+        user2_unread INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user1_id, user2_id)
+    );
+
+    -- Per-side unread counters, kept in step by the API on send and read
+    ALTER TABLE matches
+        ADD COLUMN IF NOT EXISTS user1_unread INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS user2_unread INTEGER NOT NULL DEFAULT 0;
+
+    -- Messages table
+    CREATE TABLE IF NOT EXISTS messages (
+        id SERIAL PRIMARY KEY,
+        sender_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        receiver_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        content TEXT NOT NULL,
+        is_read BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- (Re)derive the match unread counters from messages
+    UPDATE matches m SET
+        user1_unread = (SELECT COUNT(*) FROM messages
+                        WHERE sender_id = m.user2_id AND receiver_id = m.user1_id AND NOT is_read),
+        user2_unread = (SELECT COUNT(*) FROM messages
+                        WHERE sender_id = m.user1_id AND receiver_id = m.user2_id AND NOT is_read);
+
+    -- Indexes for hot lookups. likes/dismissals (user_id, car_id) and
+    -- matches (user1_id, user2_id) are already covered by their UNIQUE constraints.
+    DROP INDEX IF EXISTS idx_sessions_token;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_token_expiry ON sessions(session_token) INCLUDE (user_id, expires_at);
+    CREATE INDEX IF NOT EXISTS idx_likes_car ON likes(car_id);
+    CREATE INDEX IF NOT EXISTS idx_car_photos_car ON car_photos(car_id, is_primary DESC, id);
+    CREATE INDEX IF NOT EXISTS idx_messages_receiver_unread ON messages(receiver_id) WHERE NOT is_read;
+    CREATE INDEX IF NOT EXISTS idx_messages_conv ON messages(LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id), id);
+    CREATE INDEX IF NOT EXISTS idx_cars_active_owner_created ON cars(owner_id, created_at DESC) WHERE is_active;
+    CREATE INDEX IF NOT EXISTS idx_matches_user2 ON matches(user2_id);
+
+    -- Refresh planner statistics so new indexes are picked up immediately
+    ANALYZE;
+"""
+
+async def migrate(conn: asyncpg.Connection):
+    """Initialize database schema"""
+    await conn.execute(SCHEMA_SQL)
+
+async def main():
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL not set")
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        await conn.execute("SELECT pg_advisory_lock(hashtext('geartrade_migrate'))")
+        try:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            if current >= SCHEMA_VERSION:
+                print(f"✅ Database already at schema version {current}")
+                return
+            async with conn.transaction():
+                await migrate(conn)
+                await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", SCHEMA_VERSION)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext('geartrade_migrate'))")
+    finally:
+        await conn.close()
+    print("✅ Database migrated")
+
+if __name__ == "__main__":
+    asyncio.run(main())
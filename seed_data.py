@@ -9,6 +9,9 @@ DB_PATH = "geartrade.db"
 
 def h(p): return hashlib.sha256(p.encode()).hexdigest()
 
+# Every seeded account shares this password
+PW_HASH = h("password123")
+
 USERS = [
     ("alexracing",    "alex@gt.com",    "Miami, FL",       "Porsche obsessive. PDK only."),
     ("jordan_drives", "jordan@gt.com",  "Los Angeles, CA", "Italian cars or nothing."),
@@ -20,83 +23,120 @@ USERS = [
     ("subaroo_pete",  "pete@gt.com",    "Denver, CO",      "Flat-four fanatic."),
 ]
 
+# (owner, make, model, year, price, mileage, condition, listing_type, description, emoji)
+# in INSERT column order so rows bind straight into executemany
 CARS = [
-  { "owner":"alexracing",   "make":"Porsche",     "model":"911 Turbo S",          "year":2023, "price":230000, "mileage":5200,  "condition":"Excellent", "type":"both",  "emoji":"🏎️",
-    "desc":"Guards Red, full carbon package, PDK, Sport Chrono, ceramic brakes. Zero track time — always garage kept.",
-    "photos":["https://images.unsplash.com/photo-1614162692292-7ac56d7f7f1e?w=800&q=80","https://images.unsplash.com/photo-1580273916550-e323be2ae537?w=800&q=80","https://images.unsplash.com/photo-1503376780353-7e6692767b70?w=800&q=80"]},
-  { "owner":"jordan_drives", "make":"Ferrari",    "model":"Roma",                  "year":2022, "price":225000, "mileage":3100,  "condition":"Excellent", "type":"trade", "emoji":"🏎️",
-    "desc":"Grigio Silverstone over Charcoal leather. Adult driven, never tracked. All maintenance records.",
-    "photos":["https://images.unsplash.com/photo-1592198084033-aade902d1aae?w=800&q=80","https://images.unsplash.com/photo-1544636331-e26879cd4d9b?w=800&q=80","https://images.unsplash.com/photo-1555626906-fcf10d6851b4?w=800&q=80"]},
-  { "owner":"jdm_carlos",   "make":"Nissan",      "model":"Skyline GT-R R34",      "year":1999, "price":175000, "mileage":31000, "condition":"Excellent", "type":"trade", "emoji":"🏎️",
-    "desc":"Bayside Blue V-Spec. Federalized and titled. Completely stock, numbers matching. These are only going up.",
-    "photos":["https://images.unsplash.com/photo-1632245889029-e406faaa34cd?w=800&q=80","https://images.unsplash.com/photo-1547744152-14d985cb937f?w=800&q=80","https://images.unsplash.com/photo-1558618666-fcd25c85cd64?w=800&q=80"]},
-  { "owner":"riley_bimmer", "make":"BMW",         "model":"M4 Competition",        "year":2024, "price":88000,  "mileage":800,   "condition":"Excellent", "type":"both",  "emoji":"🚗",
-    "desc":"Isle of Man Green, 6-speed manual, carbon bucket seats. 800 miles. The spec every enthusiast wants.",
-    "photos":["https://images.unsplash.com/photo-1555215695-3004980ad54e?w=800&q=80","https://images.unsplash.com/photo-1619405399517-d7fce0f13302?w=800&q=80","https://images.unsplash.com/photo-1617531653332-bd46c16f4d68?w=800&q=80"]},
-  { "owner":"classic_diana","make":"Ford",        "model":"Mustang Mach 1",        "year":1969, "price":145000, "mileage":12000, "condition":"Excellent", "type":"sale",  "emoji":"🏎️",
-    "desc":"428 Cobra Jet, Candy Apple Red. Frame-off restoration to factory spec. Numbers matching. Trophy winner.",
-    "photos":["https://images.unsplash.com/photo-1567808291548-fc3ee04dbcf0?w=800&q=80","https://images.unsplash.com/photo-1511919884226-fd3cad34687c?w=800&q=80","https://images.unsplash.com/photo-1489824904134-891ab64532f1?w=800&q=80"]},
-  { "owner":"alice_ev",     "make":"Tesla",       "model":"Model S Plaid",         "year":2024, "price":89000,  "mileage":4900,  "condition":"Excellent", "type":"both",  "emoji":"⚡",
-    "desc":"Midnight Silver, white interior, 21\" Arachnid wheels. FSD included. Under factory warranty.",
-    "photos":["https://images.unsplash.com/photo-1560958089-b8a1929cea89?w=800&q=80","https://images.unsplash.com/photo-1571987502227-9231b837d92a?w=800&q=80","https://images.unsplash.com/photo-1617788138017-80ad40651399?w=800&q=80"]},
-  { "owner":"vinnie_v8",    "make":"Dodge",       "model":"Challenger SRT Hellcat","year":2023, "price":72000,  "mileage":6800,  "condition":"Excellent", "type":"both",  "emoji":"🐍",
-    "desc":"Hellraisin Purple, 6-speed manual, 717hp supercharged HEMI. Street only, never drag raced.",
-    "photos":["https://images.unsplash.com/photo-1612825173281-9a193378527e?w=800&q=80","https://images.unsplash.com/photo-1583121274602-3e2820c69888?w=800&q=80"]},
-  { "owner":"vinnie_v8",    "make":"Ford",        "model":"GT Heritage Edition",   "year":2019, "price":595000, "mileage":1200,  "condition":"Excellent", "type":"trade", "emoji":"🏎️",
-    "desc":"Liquid Blue, silver stripes. One of 1,350 built. Carbon everywhere. Stored since delivery.",
-    "photos":["https://images.unsplash.com/photo-1544636331-e26879cd4d9b?w=800&q=80","https://images.unsplash.com/photo-1580273916550-e323be2ae537?w=800&q=80"]},
-  { "owner":"subaroo_pete", "make":"Subaru",      "model":"WRX STI Type RA",       "year":2018, "price":48000,  "mileage":22000, "condition":"Good",      "type":"both",  "emoji":"🚗",
-    "desc":"Crystal White Pearl, stock. Only 500 made. The most capable all-weather performance car at this price.",
-    "photos":["https://images.unsplash.com/photo-1616788494707-ec28f08d05a1?w=800&q=80","https://images.unsplash.com/photo-1618843479313-40f8afb4b4d8?w=800&q=80"]},
-  { "owner":"subaroo_pete", "make":"Lamborghini", "model":"Huracán EVO",           "year":2022, "price":265000, "mileage":4500,  "condition":"Excellent", "type":"both",  "emoji":"🏎️",
-    "desc":"Giallo Orion, black Alcantara. LDVI torque vectoring, ANIMA selector, titanium exhaust. Savage.",
-    "photos":["https://images.unsplash.com/photo-1558618666-fcd25c85cd64?w=800&q=80","https://images.unsplash.com/photo-1592198084033-aade902d1aae?w=800&q=80"]},
-  { "owner":"jdm_carlos",   "make":"Toyota",      "model":"Supra MK4",             "year":1998, "price":120000, "mileage":28000, "condition":"Excellent", "type":"both",  "emoji":"🏎️",
-    "desc":"Renaissance Red, single turbo, 6-speed manual. All original, zero modifications. Holy grail of JDM.",
-    "photos":["https://images.unsplash.com/photo-1632245889029-e406faaa34cd?w=800&q=80","https://images.unsplash.com/photo-1547744152-14d985cb937f?w=800&q=80"]},
-  { "owner":"riley_bimmer", "make":"McLaren",     "model":"720S",                  "year":2021, "price":280000, "mileage":7800,  "condition":"Excellent", "type":"trade", "emoji":"🏎️",
-    "desc":"Papaya Spark, electrochromic roof, nose lift, B&W audio. Serviced at McLaren Beverly Hills.",
-    "photos":["https://images.unsplash.com/photo-1503376780353-7e6692767b70?w=800&q=80","https://images.unsplash.com/photo-1580273916550-e323be2ae537?w=800&q=80"]},
+  ("alexracing",    "Porsche",     "911 Turbo S",            2023, 230000, 5200,  "Excellent", "both",
+   "Guards Red, full carbon package, PDK, Sport Chrono, ceramic brakes. Zero track time — always garage kept.", "🏎️"),
+  ("jordan_drives", "Ferrari",     "Roma",                   2022, 225000, 3100,  "Excellent", "trade",
+   "Grigio Silverstone over Charcoal leather. Adult driven, never tracked. All maintenance records.", "🏎️"),
+  ("jdm_carlos",    "Nissan",      "Skyline GT-R R34",       1999, 175000, 31000, "Excellent", "trade",
+   "Bayside Blue V-Spec. Federalized and titled. Completely stock, numbers matching. These are only going up.", "🏎️"),
+  ("riley_bimmer",  "BMW",         "M4 Competition",         2024, 88000,  800,   "Excellent", "both",
+   "Isle of Man Green, 6-speed manual, carbon bucket seats. 800 miles. The spec every enthusiast wants.", "🚗"),
+  ("classic_diana", "Ford",        "Mustang Mach 1",         1969, 145000, 12000, "Excellent", "sale",
+   "428 Cobra Jet, Candy Apple Red. Frame-off restoration to factory spec. Numbers matching. Trophy winner.", "🏎️"),
+  ("alice_ev",      "Tesla",       "Model S Plaid",          2024, 89000,  4900,  "Excellent", "both",
+   "Midnight Silver, white interior, 21\" Arachnid wheels. FSD included. Under factory warranty.", "⚡"),
+  ("vinnie_v8",     "Dodge",       "Challenger SRT Hellcat", 2023, 72000,  6800,  "Excellent", "both",
+   "Hellraisin Purple, 6-speed manual, 717hp supercharged HEMI. Street only, never drag raced.", "🐍"),
+  ("vinnie_v8",     "Ford",        "GT Heritage Edition",    2019, 595000, 1200,  "Excellent", "trade",
+   "Liquid Blue, silver stripes. One of 1,350 built. Carbon everywhere. Stored since delivery.", "🏎️"),
+  ("subaroo_pete",  "Subaru",      "WRX STI Type RA",        2018, 48000,  22000, "Good",      "both",
+   "Crystal White Pearl, stock. Only 500 made. The most capable all-weather performance car at this price.", "🚗"),
+  ("subaroo_pete",  "Lamborghini", "Huracán EVO",            2022, 265000, 4500,  "Excellent", "both",
+   "Giallo Orion, black Alcantara. LDVI torque vectoring, ANIMA selector, titanium exhaust. Savage.", "🏎️"),
+  ("jdm_carlos",    "Toyota",      "Supra MK4",              1998, 120000, 28000, "Excellent", "both",
+   "Renaissance Red, single turbo, 6-speed manual. All original, zero modifications. Holy grail of JDM.", "🏎️"),
+  ("riley_bimmer",  "McLaren",     "720S",                   2021, 280000, 7800,  "Excellent", "trade",
+   "Papaya Spark, electrochromic roof, nose lift, B&W audio. Serviced at McLaren Beverly Hills.", "🏎️"),
+]
+
+# Photo URLs for each CARS row, same order; the first one is primary
+CAR_PHOTOS = [
+  ["https://images.unsplash.com/photo-1614162692292-7ac56d7f7f1e?w=800&q=80","https://images.unsplash.com/photo-1580273916550-e323be2ae537?w=800&q=80","https://images.unsplash.com/photo-1503376780353-7e6692767b70?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1592198084033-aade902d1aae?w=800&q=80","https://images.unsplash.com/photo-1544636331-e26879cd4d9b?w=800&q=80","https://images.unsplash.com/photo-1555626906-fcf10d6851b4?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1632245889029-e406faaa34cd?w=800&q=80","https://images.unsplash.com/photo-1547744152-14d985cb937f?w=800&q=80","https://images.unsplash.com/photo-1558618666-fcd25c85cd64?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1555215695-3004980ad54e?w=800&q=80","https://images.unsplash.com/photo-1619405399517-d7fce0f13302?w=800&q=80","https://images.unsplash.com/photo-1617531653332-bd46c16f4d68?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1567808291548-fc3ee04dbcf0?w=800&q=80","https://images.unsplash.com/photo-1511919884226-fd3cad34687c?w=800&q=80","https://images.unsplash.com/photo-1489824904134-891ab64532f1?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1560958089-b8a1929cea89?w=800&q=80","https://images.unsplash.com/photo-1571987502227-9231b837d92a?w=800&q=80","https://images.unsplash.com/photo-1617788138017-80ad40651399?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1612825173281-9a193378527e?w=800&q=80","https://images.unsplash.com/photo-1583121274602-3e2820c69888?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1544636331-e26879cd4d9b?w=800&q=80","https://images.unsplash.com/photo-1580273916550-e323be2ae537?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1616788494707-ec28f08d05a1?w=800&q=80","https://images.unsplash.com/photo-1618843479313-40f8afb4b4d8?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1558618666-fcd25c85cd64?w=800&q=80","https://images.unsplash.com/photo-1592198084033-aade902d1aae?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1632245889029-e406faaa34cd?w=800&q=80","https://images.unsplash.com/photo-1547744152-14d985cb937f?w=800&q=80"],
+  ["https://images.unsplash.com/photo-1503376780353-7e6692767b70?w=800&q=80","https://images.unsplash.com/photo-1580273916550-e323be2ae537?w=800&q=80"],
 ]
 
-def seed():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# Lookup indexes, defined exactly as the same-named ones in migrate.py. Built
+# after the bulk load so each is one sorted build instead of being maintained
+# row by row.
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_cars_active_owner_created ON cars(owner_id, created_at DESC) WHERE is_active",
+    "CREATE INDEX IF NOT EXISTS idx_car_photos_car ON car_photos(car_id, is_primary DESC, id)",
+    "CREATE INDEX IF NOT EXISTS idx_likes_car ON likes(car_id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_receiver_unread ON messages(receiver_id) WHERE NOT is_read",
+]
+
+def seed(conn=None):
+    # With no connection, open DB_PATH and own it: tune it, seed in one
+    # transaction, commit and close. A caller's connection is left as it was:
+    # no PRAGMAs, and the seed nests in a savepoint so any transaction they have
+    # open stays theirs to commit or roll back.
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
+    if own_conn:
+        # Connection-local tuning for the bulk load; nothing here sticks to the file
+        c.executescript("""
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-64000;
+        """)
     print("🌱 Seeding GearTrade...")
 
-    user_ids = {}
-    for username, email, location, bio in USERS:
-        try:
-            c.execute("INSERT INTO users (username,email,password_hash,location,bio) VALUES (?,?,?,?,?)",
-                      (username, email, h("password123"), location, bio))
-            user_ids[username] = c.lastrowid
-            print(f"  ✅ User: {username}")
-        except sqlite3.IntegrityError:
-            c.execute("SELECT id FROM users WHERE username=?", (username,))
-            user_ids[username] = c.fetchone()[0]
-            print(f"  ↩️  Exists: {username}")
-    conn.commit()
+    # One transaction for the whole seed: a single commit/fsync, and a failed
+    # run leaves the database untouched
+    c.execute("BEGIN IMMEDIATE" if own_conn else "SAVEPOINT seed")
+    try:
+        c.executemany("INSERT OR IGNORE INTO users (username,email,password_hash,location,bio) VALUES (?,?,?,?,?)",
+                      [(username, email, PW_HASH, location, bio) for username, email, location, bio in USERS])
+        print(f"  ✅ Users: {c.rowcount} new, {len(USERS) - c.rowcount} existing")
+        c.execute("SELECT username, id FROM users")
+        user_ids = dict(c.fetchall())
+
+        cars = [(car, photos) for car, photos in zip(CARS, CAR_PHOTOS) if user_ids.get(car[0])]
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM cars")
+        last_id = c.fetchone()[0]
+        c.executemany("INSERT INTO cars (owner_id,make,model,year,price,mileage,condition,listing_type,description,emoji) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                      [(user_ids[car[0]],) + car[1:] for car, _ in cars])
+        # We hold the write lock, so the new AUTOINCREMENT ids are the ones past
+        # last_id, in insert order
+        c.execute("SELECT id FROM cars WHERE id > ? ORDER BY id", (last_id,))
+        car_ids = [row[0] for row in c.fetchall()]
+        c.executemany("INSERT INTO car_photos (car_id,photo_path,is_primary) VALUES (?,?,?)",
+                      [(cid, url, 1 if i==0 else 0)
+                       for cid, (_, photos) in zip(car_ids, cars) for i, url in enumerate(photos)])
 
-    for car in CARS:
-        oid = user_ids.get(car["owner"])
-        if not oid: continue
-        try:
-            c.execute("INSERT INTO cars (owner_id,make,model,year,price,mileage,condition,listing_type,description,emoji) VALUES (?,?,?,?,?,?,?,?,?,?)",
-                      (oid, car["make"], car["model"], car["year"], car["price"],
-                       car["mileage"], car["condition"], car["type"], car["desc"], car["emoji"]))
-            cid = c.lastrowid
-            for i, url in enumerate(car["photos"]):
-                c.execute("INSERT INTO car_photos (car_id,photo_path,is_primary) VALUES (?,?,?)",
-                          (cid, url, 1 if i==0 else 0))
-            print(f"  ✅ {car['year']} {car['make']} {car['model']} — {len(car['photos'])} photos")
-        except Exception as e:
-            print(f"  ❌ {car['model']}: {e}")
-    conn.commit()
+        for ddl in INDEXES:
+            c.execute(ddl)
+        if own_conn:
+            conn.commit()
+        else:
+            c.execute("RELEASE seed")
+    except BaseException:
+        if own_conn:
+            conn.rollback()
+            conn.close()
+        else:
+            c.execute("ROLLBACK TO seed")
+            c.execute("RELEASE seed")
+        raise
 
     c.execute("SELECT COUNT(*) FROM cars"); nc = c.fetchone()[0]
     c.execute("SELECT COUNT(*) FROM car_photos"); np = c.fetchone()[0]
-    conn.close()
+    if own_conn: conn.close()
     print(f"\n🎉 Done! {len(USERS)} users · {nc} cars · {np} photos")
     print("\nAll accounts use password: password123")
     for u in USERS: print(f"   {u[0]}")